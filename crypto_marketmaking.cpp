@@ -3,7 +3,7 @@
 #include <array>
 #include <chrono>
 #include <cmath>
-#include <vector>
+#include <cstdlib>
 #include <cstdio>
 
 // ---------- Exchange API Stubs (do not modify) ----------
@@ -20,10 +20,11 @@ class Strategy {
 public:
   Strategy() {
     using namespace std::chrono;
-    last_reprice = steady_clock::now();
+    last_reprice = last_refill = steady_clock::now();
     for (size_t i = 0; i < N; ++i) {
       best_bid[i] = best_ask[i] = 0.0f;
       have_bid[i] = have_ask[i] = false;
+      dirty[i] = false;
       order_id_buy[i] = order_id_sell[i] = 0;
       pos[i] = 0.0f;
       last_trade_price[i] = 0.0f;
@@ -37,18 +38,22 @@ public:
     last_trade_price[i] = price;
     price_history[i][ph_write_idx[i]] = price;
     ph_write_idx[i] = (ph_write_idx[i] + 1) % PH_SZ;
+    dirty[i] = true;  // momentum input changed
     maybe_reprice();
   }
 
   void on_orderbook_update(Ticker ticker, Side side, float quantity, float price) {
     size_t i = idx(ticker);
     if (side == Side::buy) {
+      if (have_bid[i] && best_bid[i] == price) return;  // touch unchanged
       best_bid[i] = price;
       have_bid[i] = true;
     } else {
+      if (have_ask[i] && best_ask[i] == price) return;  // touch unchanged
       best_ask[i] = price;
       have_ask[i] = true;
     }
+    dirty[i] = true;
     maybe_reprice();
   }
 
@@ -60,8 +65,13 @@ public:
       pos[i] -= quantity;
 
     cash = capital_remaining;
-    if (pos[i] > MAX_POS) place_market_order(Side::sell, ticker, pos[i] - MAX_POS);
-    if (pos[i] < -MAX_POS) place_market_order(Side::buy, ticker, -MAX_POS - pos[i]);
+    if (pos[i] > MAX_POS) market_order(Side::sell, ticker, pos[i] - MAX_POS);
+    if (pos[i] < -MAX_POS) market_order(Side::buy, ticker, -MAX_POS - pos[i]);
+
+    // Valuation only feeds the log line, so skip it unless a print is due
+    auto now = std::chrono::steady_clock::now();
+    if (now - last_print < std::chrono::milliseconds(PRINT_MS)) return;
+    last_print = now;
 
     float total = cash;
     for (size_t j = 0; j < N; ++j)
@@ -73,9 +83,13 @@ private:
   // ===== Parameters =====
   static constexpr size_t N = 3;
   static constexpr int REPRICE_MS = 1;          // ultra-high frequency
+  static constexpr int PRINT_MS = 1000;         // portfolio log throttle
+  static constexpr float RATE_LIMIT = 10.0f;    // exchange messages per second
+  static constexpr float RATE_BURST = 10.0f;
+  static constexpr float MSGS_PER_TICKER = 5.0f; // 2 cancels + 2 places + 1 scalp, worst case
   static constexpr float ORDER_SIZE = 2.0f;
   static constexpr float MAX_POS = 250.0f;
-  static constexpr float MIN_TICK = 0.0001f;
+  static constexpr float MIN_TICK = 0.0001f;    // finest price increment, quote prices are kept in these ticks
   static constexpr float SPREAD_FACTOR = 0.25f;
   static constexpr size_t PH_SZ = 32;
   static constexpr float MOM_TH = 0.0025f;
@@ -85,16 +99,20 @@ private:
   std::array<float, N> best_ask{};
   std::array<bool, N> have_bid{};
   std::array<bool, N> have_ask{};
+  std::array<bool, N> dirty{};   // tickers needing a requote since last reprice
   std::array<std::int64_t, N> order_id_buy{};
   std::array<std::int64_t, N> order_id_sell{};
-  std::array<float, N> order_price_buy{};
-  std::array<float, N> order_price_sell{};
+  std::array<std::int64_t, N> order_ticks_buy{};   // resting price in MIN_TICK units, 0 = none
+  std::array<std::int64_t, N> order_ticks_sell{};
   std::array<float, N> pos{};
   std::array<float, N> last_trade_price{};
   std::array<std::array<float, PH_SZ>, N> price_history{};
   std::array<size_t, N> ph_write_idx{};
   float cash = 100000.0f;
   std::chrono::steady_clock::time_point last_reprice;
+  std::chrono::steady_clock::time_point last_print{};
+  float tokens = RATE_BURST;                    // order-rate token bucket
+  std::chrono::steady_clock::time_point last_refill;
 
   // ===== Utility =====
   static size_t idx(Ticker t) { return static_cast<size_t>(t); }
@@ -117,8 +135,17 @@ private:
     auto now = steady_clock::now();
     if (duration_cast<milliseconds>(now - last_reprice).count() < REPRICE_MS) return;
     last_reprice = now;
-    for (Ticker t : {Ticker::ETH, Ticker::BTC, Ticker::LTC})
-      manage_ticker(t);
+
+    float elapsed = duration<float>(now - last_refill).count();
+    tokens = std::min(RATE_BURST, tokens + elapsed * RATE_LIMIT);
+    last_refill = now;
+
+    for (size_t i = 0; i < N; ++i) {
+      if (!dirty[i]) continue;
+      if (tokens < MSGS_PER_TICKER) return;  // stays dirty until the bucket refills
+      dirty[i] = false;
+      manage_ticker(static_cast<Ticker>(i));
+    }
   }
 
   void manage_ticker(Ticker t) {
@@ -138,74 +165,91 @@ private:
     float cur_pos = pos[i];
     if (cur_pos > 0.0f) target_buy -= tick * 0.5f;
     else if (cur_pos < 0.0f) target_sell += tick * 0.5f;
+    std::int64_t buy_ticks = to_ticks(target_buy);
+    std::int64_t sell_ticks = to_ticks(target_sell);
+
+    // dead-band of half the quoting offset in ticks (never under one full tick); computed once for both sides
+    float band = 0.5f * tick / MIN_TICK;
 
     // momentum filter
     float mom = compute_momentum(i);
     if (mom < -MOM_TH) safe_cancel_buy(i);
-    else if (need_replace(order_price_buy[i], target_buy, tick)) {
+    else if (need_replace(order_ticks_buy[i], buy_ticks, band)) {
       safe_cancel_buy(i);
-      if (cur_pos < MAX_POS && cash > target_buy * ORDER_SIZE)
-        place_limit_buy(t, ORDER_SIZE, target_buy);
+      if (cur_pos < MAX_POS && cash > buy_ticks * MIN_TICK * ORDER_SIZE)
+        place_limit_buy(t, ORDER_SIZE, buy_ticks);
     }
 
     if (mom > MOM_TH) safe_cancel_sell(i);
-    else if (need_replace(order_price_sell[i], target_sell, tick)) {
+    else if (need_replace(order_ticks_sell[i], sell_ticks, band)) {
       safe_cancel_sell(i);
       if (cur_pos > -MAX_POS)
-        place_limit_sell(t, ORDER_SIZE, target_sell);
+        place_limit_sell(t, ORDER_SIZE, sell_ticks);
     }
 
     // small momentum scalping
     if (mom > MOM_TH && cur_pos > -MAX_POS)
-      place_market_order(Side::buy, t, 1.0f);
+      market_order(Side::buy, t, 1.0f);
     else if (mom < -MOM_TH && cur_pos < MAX_POS)
-      place_market_order(Side::sell, t, 1.0f);
+      market_order(Side::sell, t, 1.0f);
   }
 
-  bool need_replace(float cur, float target, float tick) {
-    return cur == 0.0f || std::fabs(cur - target) > 0.5f * tick;
+  static std::int64_t to_ticks(float price) { return std::llround(static_cast<double>(price) / MIN_TICK); }
+
+  bool need_replace(std::int64_t cur, std::int64_t target, float band) {
+    return cur == 0 || static_cast<float>(std::llabs(cur - target)) > band;
   }
 
   float compute_momentum(size_t i) {
     float short_sum = 0, long_sum = 0;
-    int short_n = 3, long_n = 12;
-    std::vector<float> vals;
-    for (size_t k = 0; k < PH_SZ; ++k) {
+    constexpr int short_n = 3, long_n = 12;
+    // walk newest to oldest, summing in place - stops once long_n prices are seen
+    int n = 0;
+    for (size_t k = 0; k < PH_SZ && n < long_n; ++k) {
       float v = price_history[i][(ph_write_idx[i] + PH_SZ - 1 - k) % PH_SZ];
-      if (v > 0.0f) vals.push_back(v);
+      if (v <= 0.0f) continue;
+      if (n < short_n) short_sum += v;
+      long_sum += v;
+      ++n;
     }
-    if ((int)vals.size() < long_n) return 0.0f;
-    for (int j = 0; j < short_n; ++j) short_sum += vals[j];
-    for (int j = 0; j < long_n; ++j) long_sum += vals[j];
+    if (n < long_n) return 0.0f;
     return ((short_sum / short_n) - (long_sum / long_n)) / (long_sum / long_n);
   }
 
   void safe_cancel_buy(size_t i) {
     if (order_id_buy[i] != 0) {
+      tokens -= 1.0f;
       cancel_order(static_cast<Ticker>(i), order_id_buy[i]);
-      order_id_buy[i] = 0; order_price_buy[i] = 0;
+      order_id_buy[i] = 0; order_ticks_buy[i] = 0;
     }
   }
   void safe_cancel_sell(size_t i) {
     if (order_id_sell[i] != 0) {
+      tokens -= 1.0f;
       cancel_order(static_cast<Ticker>(i), order_id_sell[i]);
-      order_id_sell[i] = 0; order_price_sell[i] = 0;
+      order_id_sell[i] = 0; order_ticks_sell[i] = 0;
     }
   }
-  void place_limit_buy(Ticker t, float qty, float price) {
-    std::int64_t oid = place_limit_order(Side::buy, t, qty, price, false);
+  void market_order(Side side, Ticker t, float qty) {
+    tokens -= 1.0f;
+    place_market_order(side, t, qty);
+  }
+  void place_limit_buy(Ticker t, float qty, std::int64_t ticks) {
+    tokens -= 1.0f;
+    std::int64_t oid = place_limit_order(Side::buy, t, qty, ticks * MIN_TICK, false);
     if (oid != 0) {
       size_t i = idx(t);
       order_id_buy[i] = oid;
-      order_price_buy[i] = price;
+      order_ticks_buy[i] = ticks;
     }
   }
-  void place_limit_sell(Ticker t, float qty, float price) {
-    std::int64_t oid = place_limit_order(Side::sell, t, qty, price, false);
+  void place_limit_sell(Ticker t, float qty, std::int64_t ticks) {
+    tokens -= 1.0f;
+    std::int64_t oid = place_limit_order(Side::sell, t, qty, ticks * MIN_TICK, false);
     if (oid != 0) {
       size_t i = idx(t);
       order_id_sell[i] = oid;
-      order_price_sell[i] = price;
+      order_ticks_sell[i] = ticks;
     }
   }
 };
\ No newline at end of file
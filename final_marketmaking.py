@@ -1,16 +1,26 @@
-from enum import Enum
+from enum import IntEnum
+import threading
 import time
-from collections import defaultdict, deque
+from bisect import bisect_left
+from collections import deque
 
-class Side(Enum):
+try:
+    from numba import njit
+except ImportError:  # Sandbox without numba - run the quoting core as plain Python
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+class Side(IntEnum):
     BUY = 0
     SELL = 1
 
-class Ticker(Enum):
+class Ticker(IntEnum):
     ETH = 0
     BTC = 1
     LTC = 2
 
+ALL_TICKERS = (Ticker.ETH, Ticker.BTC, Ticker.LTC)
+
 def place_market_order(side: Side, ticker: Ticker, quantity: float) -> bool:
     return True
 
@@ -20,6 +30,73 @@ def place_limit_order(side: Side, ticker: Ticker, quantity: float, price: float,
 def cancel_order(ticker: Ticker, order_id: int) -> bool:
     return True
 
+# Cancel-replace hook - no atomic modify on the exchange yet, so cancel then place
+def replace_order(side: Side, ticker: Ticker, order_id: int, quantity: float, price: float) -> int:
+    cancel_order(ticker, order_id)
+    return place_limit_order(side, ticker, quantity, price, ioc=False)
+
+# Batch wrappers - fan out to the single-order API until the exchange batch endpoint is wired in
+def batch_cancel_orders(orders: list) -> list:
+    return [cancel_order(ticker, order_id) for ticker, order_id in orders]
+
+def batch_place_orders(orders: list) -> list:
+    return [place_limit_order(side, ticker, quantity, price, ioc=False) for side, ticker, quantity, price in orders]
+
+def batch_replace_orders(orders: list) -> list:
+    return [replace_order(side, ticker, order_id, quantity, price) for side, ticker, order_id, quantity, price in orders]
+
+def update_level(prices: list, qtys: list, price: int, quantity: float) -> float:
+    """Apply a price level update (price in ticks) to parallel sorted price/size lists, returns the change in resting size"""
+    i = bisect_left(prices, price)
+    if i < len(prices) and prices[i] == price:
+        old = qtys[i]
+        if quantity > 0:
+            qtys[i] = quantity
+            return quantity - old
+        del prices[i]
+        del qtys[i]
+        return -old
+    if quantity > 0:
+        prices.insert(i, price)
+        qtys.insert(i, quantity)
+        return quantity
+    return 0.0
+
+@njit(cache=True)
+def decide_quotes(
+    book_imbalance: float, flow_imbalance: float, best_bid: float, best_ask: float,
+    book_threshold: float, bearish_threshold: float, flow_min: float, flow_max: float, mid_shift: float,
+) -> tuple:
+    """Quoting core on plain floats, returns (should_quote, buy_price, buy_size, sell_price, sell_size)"""
+    # CHECK: Flow must be neutral (avoid aggressive informed traders)
+    if not (flow_min <= flow_imbalance <= flow_max):
+        return False, 0.0, 0.0, 0.0, 0.0
+    
+    mid = (best_bid + best_ask) / 2
+    spread = best_ask - best_bid
+    
+    # Exploit book imbalance with competitive pricing
+    if book_imbalance > book_threshold:
+        # BULLISH: More buyers - competitive sell, avoid buying
+        sell_price = mid + (mid_shift * spread)  # Inside spread - competitive!
+        sell_size = 100.0
+        
+        buy_price = best_bid - (2.0 * spread)  # Far below - avoid buying
+        buy_size = 50.0
+        
+    elif book_imbalance < bearish_threshold:
+        # BEARISH: More sellers - competitive buy, avoid selling
+        buy_price = mid - (mid_shift * spread)  # Inside spread - competitive!
+        buy_size = 100.0
+        
+        sell_price = best_ask + (2.0 * spread)  # Far above - avoid selling
+        sell_size = 50.0
+        
+    else:
+        return False, 0.0, 0.0, 0.0, 0.0
+    
+    return True, buy_price, buy_size, sell_price, sell_size
+
 # You can use print() and view the logs after sandbox run has completed
 class Strategy:
     def __init__(self) -> None:
@@ -30,73 +107,194 @@ class Strategy:
         self.FLOW_MAX = 1.10
         self.TRADE_WINDOW = 10
         self.UPDATE_INTERVAL = 0.1
+        self.TICK_SIZE = 0.0001  # Finest price increment the books carry - levels are keyed in whole ticks
         self.MID_SHIFT = 0.25
+        self.DEBUG = False  # Log imbalances on every requote (slow)
         # =========================
         
+        # Config in decide_quotes argument order, read once per requote
+        self.quote_params = (self.BOOK_THRESHOLD, 1.0 / self.BOOK_THRESHOLD, self.FLOW_MIN, self.FLOW_MAX, self.MID_SHIFT)
+        # Compile the quoting core here rather than inside the first live requote (no-op without numba)
+        decide_quotes(1.0, 1.0, 1.0, 1.01, *self.quote_params)
+        
         # Orderbook tracking
-        self.bids = defaultdict(dict)
-        self.asks = defaultdict(dict)
+        self.bid_prices = {t: [] for t in ALL_TICKERS}  # Sorted price levels in ticks, best bid at [-1]
+        self.ask_prices = {t: [] for t in ALL_TICKERS}  # Sorted price levels in ticks, best ask at [0]
+        self.bid_qtys = {t: [] for t in ALL_TICKERS}    # Resting size, aligned with *_prices
+        self.ask_qtys = {t: [] for t in ALL_TICKERS}
+        self.bid_qty_sum = {t: 0.0 for t in ALL_TICKERS}  # Running total of resting size per side
+        self.ask_qty_sum = {t: 0.0 for t in ALL_TICKERS}
+        self.best_bid = {t: None for t in ALL_TICKERS}  # Touch in ticks, None while the side is empty
+        self.best_ask = {t: None for t in ALL_TICKERS}
         
         # Trade flow tracking
-        self.recent_trades = defaultdict(deque)
+        self.trade_times = {t: deque() for t in ALL_TICKERS}  # Parallel columns, one entry per trade
+        self.trade_sides = {t: deque() for t in ALL_TICKERS}  # Side value as plain int
+        self.trade_qtys = {t: deque() for t in ALL_TICKERS}
+        self.flow_sums = {t: [0.0, 0.0] for t in ALL_TICKERS}  # Aggressive size inside TRADE_WINDOW, indexed by side value
         
         # Order management
-        self.active_orders = defaultdict(list)
+        self.active_orders = {t: [] for t in ALL_TICKERS}
+        self.last_quote = {t: None for t in ALL_TICKERS}  # Quote behind active_orders, None if not resting
+        self.pending_cancels = []  # (ticker, order_id)
+        self.pending_places = []   # (side, ticker, quantity, price)
+        self.pending_replaces = [] # (side, ticker, order_id, quantity, price)
+        self.in_flight = set()  # Tickers with a claimed batch out at the exchange
         
         # Timing
-        self.last_update = defaultdict(float)
+        self.last_update = {t: 0.0 for t in ALL_TICKERS}
+        self.dirty = set()  # Tickers whose touch or quoting regime moved since their last requote
+        self.regime = {t: 0 for t in ALL_TICKERS}  # Last regime seen: 1 bullish, -1 bearish, 0 standing aside
+        self.requote_timers = {t: None for t in ALL_TICKERS}  # Deferred requote armed while the gate holds a dirty ticker back
+        
+        # Callback locking - the exchange may dispatch events from more than one thread.
+        # Neither lock is held across an exchange call, so a fill delivered inside one can take them itself.
+        self.book_locks = {t: threading.Lock() for t in ALL_TICKERS}  # One ticker's book, touch and trade window
+        self.order_lock = threading.Lock()  # Order queues, quote cache and fill stats shared by all tickers
         
         # Performance tracking
         self.buy_fills = 0
         self.sell_fills = 0
-        self.last_print_time = time.time()
+        self.last_print_time = time.monotonic()
         
-        if self.TRADE_TICKER:
+        if self.TRADE_TICKER is not None:
             print(f"Market maker initialized - trading {self.TRADE_TICKER.name} only")
         else:
             print("Market maker initialized - trading all tickers")
     
-    def should_trade(self, ticker: Ticker) -> bool:
-        if self.TRADE_TICKER is None:
-            return True
-        return ticker == self.TRADE_TICKER
-    
     def on_trade_update(self, ticker: Ticker, side: Side, quantity: float, price: float) -> None:
-        if not self.should_trade(ticker):
+        if self.TRADE_TICKER is not None and ticker != self.TRADE_TICKER:
             return
         
-        self.recent_trades[ticker].append({
-            'time': time.time(),
-            'side': side,
-            'qty': quantity
-        })
+        with self.book_locks[ticker]:
+            now = time.monotonic()
+            self.trade_times[ticker].append(now)
+            self.trade_sides[ticker].append(side.value)
+            self.trade_qtys[ticker].append(quantity)
+            self.flow_sums[ticker][side.value] += quantity
+            
+            self.expire_trades(ticker, now)
+            if not self.update_regime(ticker, now):
+                return  # Flow stayed on the same side of its bands - quotes still valid
+            self.dirty.add(ticker)
+            batch = self.try_requote(ticker, now)
+        
+        self.send_orders(ticker, batch)
+    
+    def expire_trades(self, ticker: Ticker, now: float) -> None:
+        """Drop trades older than TRADE_WINDOW and take them out of the running flow sums"""
+        cutoff = now - self.TRADE_WINDOW
+        times = self.trade_times[ticker]
+        if not times or times[0] > cutoff:
+            return  # Nothing aged out
+        
+        sides = self.trade_sides[ticker]
+        qtys = self.trade_qtys[ticker]
+        expired = [0.0, 0.0]
+        while times and times[0] <= cutoff:
+            times.popleft()
+            expired[sides.popleft()] += qtys.popleft()
         
-        cutoff = time.time() - 60
-        while self.recent_trades[ticker] and self.recent_trades[ticker][0]['time'] < cutoff:
-            self.recent_trades[ticker].popleft()
+        sums = self.flow_sums[ticker]
+        if times:
+            sums[0] -= expired[0]
+            sums[1] -= expired[1]
+        else:
+            # Window empty - reset so float drift can't build up
+            sums[0] = sums[1] = 0.0
     
     def on_orderbook_update(
         self, ticker: Ticker, side: Side, quantity: float, price: float
     ) -> None:
-        if not self.should_trade(ticker):
+        if self.TRADE_TICKER is not None and ticker != self.TRADE_TICKER:
             return
         
-        if side == Side.BUY:
-            if quantity > 0:
-                self.bids[ticker][price] = quantity
+        with self.book_locks[ticker]:
+            tick = round(price / self.TICK_SIZE)  # Exact integer key, immune to float drift between messages
+            if side == Side.BUY:
+                self.bid_qty_sum[ticker] += update_level(self.bid_prices[ticker], self.bid_qtys[ticker], tick, quantity)
             else:
-                self.bids[ticker].pop(price, None)
-        else:
-            if quantity > 0:
-                self.asks[ticker][price] = quantity
-            else:
-                self.asks[ticker].pop(price, None)
+                self.ask_qty_sum[ticker] += update_level(self.ask_prices[ticker], self.ask_qtys[ticker], tick, quantity)
+            
+            now = time.monotonic()
+            if self.update_touch(ticker, side):
+                self.dirty.add(ticker)
+            if self.update_regime(ticker, now):
+                self.dirty.add(ticker)
+            if ticker not in self.dirty:
+                return  # Deeper level changed inside the same regime - quotes still valid
+            
+            batch = self.try_requote(ticker, now)
         
-        if time.time() - self.last_update[ticker] < self.UPDATE_INTERVAL:
-            return
-        self.last_update[ticker] = time.time()
+        self.send_orders(ticker, batch)
+    
+    def try_requote(self, ticker: Ticker, now: float):
+        """Claim a requote for a dirty ticker if the gate is open, otherwise arm a timer - caller holds its book lock, returns the batch for send_orders"""
+        with self.order_lock:
+            if ticker in self.in_flight:
+                return None  # Its sender requotes once the batch is back
+            if not self.should_requote(ticker, now):
+                self.schedule_requote(ticker, now)
+                return None  # Stays dirty until the gate opens
+            self.dirty.discard(ticker)
+            
+            batch = self.take_orders(self.update_quotes(ticker, now))
+            if batch is not None:
+                self.in_flight.add(ticker)
+            return batch
+    
+    def schedule_requote(self, ticker: Ticker, now: float) -> None:
+        """Arm a one-shot timer so the ticker's latest book still gets quoted if no further update arrives"""
+        if self.requote_timers[ticker] is not None:
+            return  # Already armed - it will see whatever the book looks like when it fires
+        wait = self.last_update[ticker] + self.UPDATE_INTERVAL - now
+        timer = threading.Timer(max(wait, 0.0), self.requote_dirty, args=(ticker,))
+        timer.daemon = True
+        self.requote_timers[ticker] = timer
+        timer.start()
+    
+    def requote_dirty(self, ticker: Ticker) -> None:
+        """Timer callback - requote from the terminal book state if the ticker is still dirty"""
+        with self.book_locks[ticker]:
+            self.requote_timers[ticker] = None
+            if ticker not in self.dirty:
+                return
+            batch = self.try_requote(ticker, time.monotonic())
         
-        self.update_quotes(ticker)
+        self.send_orders(ticker, batch)
+    
+    def update_touch(self, ticker: Ticker, side: Side) -> bool:
+        """Refresh cached best bid/ask from the sorted levels, returns True if the touch price moved"""
+        if side == Side.BUY:
+            prices = self.bid_prices[ticker]
+            best = prices[-1] if prices else None
+            if best == self.best_bid[ticker]:
+                return False
+            self.best_bid[ticker] = best
+        else:
+            prices = self.ask_prices[ticker]
+            best = prices[0] if prices else None
+            if best == self.best_ask[ticker]:
+                return False
+            self.best_ask[ticker] = best
+        return True
+    
+    def update_regime(self, ticker: Ticker, now: float) -> bool:
+        """Refresh the cached quoting regime from the running book and flow totals, returns True if it flipped"""
+        book_threshold, bearish_threshold, flow_min, flow_max, _ = self.quote_params
+        book_imbalance = self.get_book_imbalance(ticker)
+        if not (flow_min <= self.get_flow_imbalance(ticker, now) <= flow_max):
+            regime = 0  # Flow skewed - stand aside whatever the book says
+        elif book_imbalance > book_threshold:
+            regime = 1
+        elif book_imbalance < bearish_threshold:
+            regime = -1
+        else:
+            regime = 0
+        if regime == self.regime[ticker]:
+            return False
+        self.regime[ticker] = regime
+        return True
     
     def on_account_update(
         self,
@@ -106,100 +304,166 @@ class Strategy:
         quantity: float,
         capital_remaining: float,
     ) -> None:
-        if not self.should_trade(ticker):
+        if self.TRADE_TICKER is not None and ticker != self.TRADE_TICKER:
             return
         
-        # Track fills
-        if side == Side.BUY:
-            self.buy_fills += 1
-        else:
-            self.sell_fills += 1
+        with self.order_lock:
+            # A fill takes size out of one side - requote in full next time
+            self.last_quote[ticker] = None
+            
+            # Track fills
+            if side == Side.BUY:
+                self.buy_fills += 1
+            else:
+                self.sell_fills += 1
+            
+            # Print stats every 30 seconds
+            current_time = time.monotonic()
+            if current_time - self.last_print_time >= 30:
+                total_trades = self.buy_fills + self.sell_fills
+                print(f"=== 30s Stats ===")
+                print(f"Total trades: {total_trades} (Buys: {self.buy_fills}, Sells: {self.sell_fills})")
+                print(f"=================")
+                self.last_print_time = current_time
         
-        # Print stats every 30 seconds
-        current_time = time.time()
-        if current_time - self.last_print_time >= 30:
-            total_trades = self.buy_fills + self.sell_fills
-            print(f"=== 30s Stats ===")
-            print(f"Total trades: {total_trades} (Buys: {self.buy_fills}, Sells: {self.sell_fills})")
-            print(f"=================")
-            self.last_print_time = current_time
+        with self.book_locks[ticker]:
+            self.dirty.add(ticker)  # Repost the filled leg without waiting for a touch move
+            batch = self.try_requote(ticker, time.monotonic())
+        
+        self.send_orders(ticker, batch)
         
         #print(f"Fill: {side.name} {quantity} {ticker.name} @ {price:.2f}")
     
     def get_book_imbalance(self, ticker: Ticker) -> float:
-        if not self.bids[ticker] or not self.asks[ticker]:
+        if not self.bid_prices[ticker] or not self.ask_prices[ticker]:
             return 1.0
         
-        bid_qty = sum(self.bids[ticker].values())
-        ask_qty = sum(self.asks[ticker].values())
+        bid_qty = self.bid_qty_sum[ticker]
+        ask_qty = self.ask_qty_sum[ticker]
         
         if ask_qty == 0:
             return 5.0
         return bid_qty / ask_qty
     
-    def get_flow_imbalance(self, ticker: Ticker) -> float:
-        cutoff = time.time() - self.TRADE_WINDOW
-        
-        aggressive_buys = 0.0
-        aggressive_sells = 0.0
+    def get_flow_imbalance(self, ticker: Ticker, now: float) -> float:
+        self.expire_trades(ticker, now)
         
-        for trade in self.recent_trades[ticker]:
-            if trade['time'] > cutoff:
-                if trade['side'] == Side.BUY:
-                    aggressive_buys += trade['qty']
-                else:
-                    aggressive_sells += trade['qty']
+        aggressive_buys, aggressive_sells = self.flow_sums[ticker]
         
         if aggressive_sells == 0:
             return 5.0 if aggressive_buys > 0 else 1.0
         return aggressive_buys / aggressive_sells
     
-    def update_quotes(self, ticker: Ticker):
-        """Biased market making with shifted mid"""
-        if not self.bids[ticker] or not self.asks[ticker]:
-            return
+    def update_quotes(self, ticker: Ticker, now: float) -> list:
+        """Biased market making with shifted mid, returns the active_orders slots the new order ids fill"""
+        if not self.bid_prices[ticker] or not self.ask_prices[ticker]:
+            return []
         
         book_imbalance = self.get_book_imbalance(ticker)
-        flow_imbalance = self.get_flow_imbalance(ticker)
+        flow_imbalance = self.get_flow_imbalance(ticker, now)
 
-        print(f"{ticker.name} - Book: {book_imbalance:.2f}, Flow: {flow_imbalance:.2f}")
-        
-        for order_id in self.active_orders[ticker]:
-            cancel_order(ticker, order_id)
-        self.active_orders[ticker] = []
+        if self.DEBUG:
+            print(f"{ticker.name} - Book: {book_imbalance:.2f}, Flow: {flow_imbalance:.2f}")
         
-        best_bid = max(self.bids[ticker].keys())
-        best_ask = min(self.asks[ticker].keys())
-        mid = (best_bid + best_ask) / 2
-        spread = best_ask - best_bid
+        should_quote, buy_price, buy_size, sell_price, sell_size = decide_quotes(
+            book_imbalance, flow_imbalance,
+            self.best_bid[ticker] * self.TICK_SIZE, self.best_ask[ticker] * self.TICK_SIZE,
+            *self.quote_params,
+        )
+        if not should_quote:
+            self.queue_cancels(ticker)
+            return []
         
-        # CHECK: Flow must be neutral (avoid aggressive informed traders)
-        flow_is_neutral = self.FLOW_MIN <= flow_imbalance <= self.FLOW_MAX
+        quote = (buy_price, sell_price, buy_size, sell_size)
+        last = self.last_quote[ticker]
+        if quote == last:
+            return []  # Resting orders already match - leave them in the queue
         
-        if not flow_is_neutral:
-            return
-        
-        # Exploit book imbalance with competitive pricing
-        if book_imbalance > self.BOOK_THRESHOLD:
-            # BULLISH: More buyers - competitive sell, avoid buying
-            sell_price = mid + (self.MID_SHIFT * spread)  # Inside spread - competitive!
-            sell_size = 100
-            
-            buy_price = best_bid - (2.0 * spread)  # Far below - avoid buying
-            buy_size = 50
-            
-        elif book_imbalance < (1.0 / self.BOOK_THRESHOLD):
-            # BEARISH: More sellers - competitive buy, avoid selling
-            buy_price = mid - (self.MID_SHIFT * spread)  # Inside spread - competitive!
-            buy_size = 100
-            
-            sell_price = best_ask + (2.0 * spread)  # Far above - avoid selling
-            sell_size = 50
-            
+        if last is not None and len(self.active_orders[ticker]) == 2:
+            legs = self.replace_quotes(ticker, last, quote)
         else:
-            return
-        
-        buy_id = place_limit_order(Side.BUY, ticker, buy_size, buy_price, ioc=False)
-        sell_id = place_limit_order(Side.SELL, ticker, sell_size, sell_price, ioc=False)
+            self.queue_cancels(ticker)
+            self.pending_places.append((Side.BUY, ticker, buy_size, buy_price))
+            self.pending_places.append((Side.SELL, ticker, sell_size, sell_price))
+            self.active_orders[ticker].extend((None, None))  # Ids land once the batch is back
+            legs = [0, 1]
+        self.last_quote[ticker] = quote
+        return legs
+    
+    def replace_quotes(self, ticker: Ticker, last: tuple, quote: tuple) -> list:
+        """Queue in-place modifies for both resting legs, returns the legs replaced - a leg whose price and size held keeps its order"""
+        buy_price, sell_price, buy_size, sell_size = quote
+        order_ids = self.active_orders[ticker]  # [buy_id, sell_id], updated in place
+        legs = []
+        if buy_price != last[0] or buy_size != last[2]:
+            legs.append(0)
+            self.pending_replaces.append((Side.BUY, ticker, order_ids[0], buy_size, buy_price))
+        if sell_price != last[1] or sell_size != last[3]:
+            legs.append(1)
+            self.pending_replaces.append((Side.SELL, ticker, order_ids[1], sell_size, sell_price))
+        return legs
+    
+    def queue_cancels(self, ticker: Ticker) -> None:
+        """Queue cancels for the ticker's resting quotes"""
+        order_ids = self.active_orders[ticker]
+        self.pending_cancels.extend((ticker, order_id) for order_id in order_ids)
+        order_ids.clear()
+        self.last_quote[ticker] = None
+    
+    def should_requote(self, ticker: Ticker, now: float) -> bool:
+        """Requote gate - UPDATE_INTERVAL has passed since the ticker's last requote"""
+        if now - self.last_update[ticker] < self.UPDATE_INTERVAL:
+            return False
+        self.last_update[ticker] = now
+        return True
+    
+    def take_orders(self, legs: list):
+        """Claim everything queued as one batch, None if nothing is queued"""
+        if not (self.pending_cancels or self.pending_replaces or self.pending_places):
+            return None
+        batch = (self.pending_cancels, self.pending_replaces, self.pending_places, legs)
+        self.pending_cancels = []
+        self.pending_replaces = []
+        self.pending_places = []
+        return batch
+    
+    def send_orders(self, ticker: Ticker, batch) -> None:
+        """Send claimed batches with no lock held, then file the returned ids and requote anything dirtied meanwhile"""
+        while batch is not None:
+            order_ids = None
+            try:
+                order_ids = self.flush_orders(batch)
+            finally:
+                # Also runs when an order call raises, so the ticker is never left stuck in flight
+                with self.book_locks[ticker]:
+                    with self.order_lock:
+                        self.file_orders(ticker, batch[3], order_ids)
+            
+            with self.book_locks[ticker]:
+                batch = self.try_requote(ticker, time.monotonic()) if ticker in self.dirty else None
+    
+    def file_orders(self, ticker: Ticker, legs: list, order_ids) -> None:
+        """Store the ids a batch came back with (None if sending it raised) and release the ticker's in-flight claim"""
+        slots = self.active_orders[ticker]
+        for leg, order_id in zip(legs, order_ids or ()):
+            slots[leg] = order_id
+        if order_ids is None or not all(slots):
+            # Drop the legs that never went out or came back rejected (id 0, no order) and
+            # forget the quote so the next requote reposts them
+            slots[:] = [order_id for order_id in slots if order_id]
+            self.last_quote[ticker] = None
+            self.dirty.add(ticker)
+        self.in_flight.discard(ticker)
+    
+    def flush_orders(self, batch: tuple) -> list:
+        """Send one batch, cancels then replaces then places so freed capital backs the new quotes"""
+        cancels, replaces, places, _ = batch
+        if cancels:
+            batch_cancel_orders(cancels)
         
-        self.active_orders[ticker] = [buy_id, sell_id]
\ No newline at end of file
+        order_ids = []
+        if replaces:
+            order_ids = batch_replace_orders(replaces)
+        if places:
+            order_ids += batch_place_orders(places)
+        return order_ids
\ No newline at end of file
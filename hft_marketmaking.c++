@@ -1,7 +1,6 @@
 #include <cstdint>
 #include <string>
-#include <unordered_map>
-#include <map>
+#include <array>
 #include <deque>
 #include <vector>
 #include <cmath>
@@ -9,6 +8,8 @@
 #include <sstream>
 #include <iomanip>
 #include <algorithm>
+#include <utility>
+#include <mutex>
 
 enum class Side { buy = 0, sell = 1 };
 enum class Ticker : std::uint8_t { ETH = 0, BTC = 1, LTC = 2 };
@@ -25,8 +26,73 @@ struct Trade {
     float qty;
 };
 
+// One side of a book as parallel price/size columns, prices ascending in ticks
+struct BookSide {
+    std::vector<std::int64_t> prices;
+    std::vector<float> qtys;
+    
+    bool empty() const { return prices.empty(); }
+    
+    // Apply one level update, returns the change in resting size
+    double update(std::int64_t price, float quantity) {
+        auto it = std::lower_bound(prices.begin(), prices.end(), price);
+        auto qty = qtys.begin() + (it - prices.begin());
+        if (it != prices.end() && *it == price) {
+            double old = *qty;
+            if (quantity > 0.0f) {
+                *qty = quantity;
+                return quantity - old;
+            }
+            prices.erase(it);
+            qtys.erase(qty);
+            return -old;
+        }
+        if (quantity > 0.0f) {
+            prices.insert(it, price);
+            qtys.insert(qty, quantity);
+            return quantity;
+        }
+        return 0.0;
+    }
+};
+
+// Orders claimed under the mutexes and sent once they are released
+struct OrderBatch {
+    std::vector<std::int64_t> cancels;
+    bool place = false;
+    float buy_price = 0.0f;
+    float sell_price = 0.0f;
+    
+    bool empty() const { return cancels.empty() && !place; }
+};
+
+// Round-trip time and rejects for one kind of order API call, one record per order
+struct LatencyTracker {
+    long calls = 0;
+    long failures = 0;
+    double total_time = 0.0;
+    double max_time = 0.0;
+    
+    void record(double elapsed, bool failed = false) {
+        ++calls;
+        if (failed) ++failures;
+        total_time += elapsed;
+        if (elapsed > max_time) max_time = elapsed;
+    }
+    
+    std::string summary() const {
+        std::ostringstream out;
+        out << std::fixed << std::setprecision(2)
+            << calls << " calls, mean " << (calls ? total_time / calls : 0.0) * 1000.0
+            << "ms, max " << max_time * 1000.0 << "ms, " << failures << " failed";
+        return out.str();
+    }
+};
+
 class Strategy {
 private:
+    static constexpr std::size_t NUM_TICKERS = 3;  // per-ticker state lives in arrays indexed by Ticker value
+    
     // ===== CONFIGURATION =====
     static constexpr Ticker TRADE_TICKER = Ticker::LTC;
     static constexpr float BOOK_THRESHOLD = 1.5f;
@@ -35,29 +101,64 @@ private:
     static constexpr int TRADE_WINDOW = 10;
     static constexpr double UPDATE_INTERVAL = 0.05;  // Faster updates for more gains
     static constexpr float MID_SHIFT = 0.25f;
+    static constexpr double PRICE_TICK = 0.0001;  // finest price increment the books carry, levels keyed in whole ticks
     static constexpr float BUY_SIZE = 100.0f;
     static constexpr float SELL_SIZE = 100.0f;
     // =========================
     
-    // Orderbook tracking - use map for O(log n) best bid/ask
-    std::unordered_map<int, std::map<float, float>> bids;  // ticker -> price -> qty
-    std::unordered_map<int, std::map<float, float>> asks;  // ticker -> price -> qty
+    // Orderbook tracking - flat sorted columns, best bid at back, best ask at front
+    std::array<BookSide, NUM_TICKERS> bids;
+    std::array<BookSide, NUM_TICKERS> asks;
+    std::array<double, NUM_TICKERS> bid_total{};  // running resting size per side
+    std::array<double, NUM_TICKERS> ask_total{};
+    std::array<std::int64_t, NUM_TICKERS> best_bid{};  // cached touch in ticks, 0 while the side is empty
+    std::array<std::int64_t, NUM_TICKERS> best_ask{};
     
     // Trade flow tracking
-    std::unordered_map<int, std::deque<Trade>> recent_trades;
+    std::array<std::deque<Trade>, NUM_TICKERS> recent_trades;
+    std::array<std::array<double, 2>, NUM_TICKERS> flow_in_window{};  // aggressive size inside TRADE_WINDOW, indexed by side
     
     // Order management
-    std::unordered_map<int, std::vector<std::int64_t>> active_orders;
+    std::array<std::vector<std::int64_t>, NUM_TICKERS> active_orders;
+    std::array<std::pair<float, float>, NUM_TICKERS> last_quote{};  // buy/sell price behind active_orders
+    std::array<bool, NUM_TICKERS> quote_resting{};  // false once last_quote no longer matches the book
+    std::array<bool, NUM_TICKERS> in_flight{};  // a claimed batch is out at the exchange
     
     // Timing
-    std::unordered_map<int, double> last_update;
+    std::array<double, NUM_TICKERS> last_update{};
+    std::array<bool, NUM_TICKERS> dirty{};  // touch or quoting regime moved since the last requote
+    std::array<int, NUM_TICKERS> regime{};  // last regime seen: 1 bullish, -1 bearish, 0 standing aside
+    double last_print_time = 0.0;
+    
+    // Order API latency
+    LatencyTracker cancel_latency;
+    LatencyTracker place_latency;
+    
+    // Callback locking - the exchange may dispatch events from more than one thread.
+    // Neither mutex is held across an exchange call, so a fill delivered inside one can lock them itself.
+    std::array<std::mutex, NUM_TICKERS> book_mutex;  // one ticker's book, touch and trade window
+    std::mutex order_mutex;  // quote state, latency stats and print timer
     
     double get_time() const {
         return std::chrono::duration<double>(
-            std::chrono::high_resolution_clock::now().time_since_epoch()
+            std::chrono::steady_clock::now().time_since_epoch()
         ).count();
     }
     
+    // Refresh the cached best bid/ask, returns true if the touch price moved
+    bool update_touch(int t, Side side) {
+        if (side == Side::buy) {
+            std::int64_t best = bids[t].empty() ? 0 : bids[t].prices.back();
+            if (best == best_bid[t]) return false;
+            best_bid[t] = best;
+        } else {
+            std::int64_t best = asks[t].empty() ? 0 : asks[t].prices.front();
+            if (best == best_ask[t]) return false;
+            best_ask[t] = best;
+        }
+        return true;
+    }
+    
     bool should_trade(Ticker ticker) const {
         return ticker == TRADE_TICKER;
     }
@@ -69,40 +170,69 @@ private:
             return 1.0f;
         }
         
-        float bid_qty = 0.0f;
-        for (auto& p : bids[t]) bid_qty += p.second;
+        double bid_qty = bid_total[t];
+        double ask_qty = ask_total[t];
         
-        float ask_qty = 0.0f;
-        for (auto& p : asks[t]) ask_qty += p.second;
+        if (ask_qty == 0.0) return 5.0f;
+        return static_cast<float>(bid_qty / ask_qty);
+    }
+    
+    // Drop trades older than TRADE_WINDOW and take them out of the running sums
+    void expire_trades(int t, double now) {
+        double cutoff = now - TRADE_WINDOW;
+        auto& trades = recent_trades[t];
+        if (trades.empty() || trades.front().time > cutoff) return;  // nothing aged out
         
-        if (ask_qty == 0.0f) return 5.0f;
-        return bid_qty / ask_qty;
+        auto& flow = flow_in_window[t];
+        while (!trades.empty() && trades.front().time <= cutoff) {
+            const Trade& trade = trades.front();
+            flow[static_cast<int>(trade.side)] -= trade.qty;
+            trades.pop_front();
+        }
+        if (trades.empty()) {
+            // window empty - reset so rounding drift can't build up
+            flow = {};
+        }
     }
     
-    float get_flow_imbalance(Ticker ticker) {
+    float get_flow_imbalance(Ticker ticker, double now) {
         int t = static_cast<int>(ticker);
-        double cutoff = get_time() - TRADE_WINDOW;
+        expire_trades(t, now);
         
-        float aggressive_buys = 0.0f;
-        float aggressive_sells = 0.0f;
+        double aggressive_buys = flow_in_window[t][static_cast<int>(Side::buy)];
+        double aggressive_sells = flow_in_window[t][static_cast<int>(Side::sell)];
         
-        for (auto& trade : recent_trades[t]) {
-            if (trade.time > cutoff) {
-                if (trade.side == Side::buy) {
-                    aggressive_buys += trade.qty;
-                } else {
-                    aggressive_sells += trade.qty;
-                }
-            }
+        if (aggressive_sells == 0.0) {
+            return aggressive_buys > 0.0 ? 5.0f : 1.0f;
         }
+        return static_cast<float>(aggressive_buys / aggressive_sells);
+    }
+    
+    // Refresh the cached quoting regime from the running book and flow totals, returns true if it flipped
+    bool update_regime(Ticker ticker, double now) {
+        int t = static_cast<int>(ticker);
+        float flow_imbalance = get_flow_imbalance(ticker, now);
+        float book_imbalance = get_book_imbalance(ticker);
         
-        if (aggressive_sells == 0.0f) {
-            return aggressive_buys > 0.0f ? 5.0f : 1.0f;
+        int next = 0;  // flow skewed or book neutral - stand aside
+        if (flow_imbalance >= FLOW_MIN && flow_imbalance <= FLOW_MAX) {
+            if (book_imbalance > BOOK_THRESHOLD) next = 1;
+            else if (book_imbalance < (1.0f / BOOK_THRESHOLD)) next = -1;
         }
-        return aggressive_buys / aggressive_sells;
+        if (next == regime[t]) return false;
+        regime[t] = next;
+        return true;
+    }
+    
+    // Queue cancels for the ticker's resting quotes and forget their prices
+    void cancel_quotes(Ticker ticker, OrderBatch& batch) {
+        int t = static_cast<int>(ticker);
+        batch.cancels.insert(batch.cancels.end(), active_orders[t].begin(), active_orders[t].end());
+        active_orders[t].clear();
+        quote_resting[t] = false;
     }
     
-    void update_quotes(Ticker ticker) {
+    void update_quotes(Ticker ticker, double now, OrderBatch& batch) {
         int t = static_cast<int>(ticker);
         
         if (bids[t].empty() || asks[t].empty()) {
@@ -110,57 +240,135 @@ private:
         }
         
         float book_imbalance = get_book_imbalance(ticker);
-        float flow_imbalance = get_flow_imbalance(ticker);
-        
-        // Cancel all active orders
-        for (auto oid : active_orders[t]) {
-            try {
-                cancel_order(ticker, oid);
-            } catch (...) {}
-        }
-        active_orders[t].clear();
+        float flow_imbalance = get_flow_imbalance(ticker, now);
         
         // Get best bid/ask
-        float best_bid = bids[t].rbegin()->first;
-        float best_ask = asks[t].begin()->first;
-        float mid = (best_bid + best_ask) * 0.5f;
-        float spread = best_ask - best_bid;
-        float half_spread = spread * 0.5f;
+        float bid = best_bid[t] * PRICE_TICK;
+        float ask = best_ask[t] * PRICE_TICK;
         
         // CHECK: Flow must be neutral
         bool flow_is_neutral = (flow_imbalance >= FLOW_MIN) && (flow_imbalance <= FLOW_MAX);
         
         if (!flow_is_neutral) {
+            cancel_quotes(ticker, batch);
             return;  // Avoid adverse selection
         }
         
-        float adjusted_mid = mid;
-        float buy_price = 0.0f;
-        float sell_price = 0.0f;
+        bool bullish = book_imbalance > BOOK_THRESHOLD;
+        bool bearish = book_imbalance < (1.0f / BOOK_THRESHOLD);
+        if (!bullish && !bearish) {
+            cancel_quotes(ticker, batch);
+            return;  // Book neutral - sit out
+        }
+        
+        // Shifted mid -/+ half the spread is just the touch moved by the shift
+        float shift = (bullish ? MID_SHIFT : -MID_SHIFT) * (ask - bid);
+        float buy_price = bid + shift;
+        float sell_price = ask + shift;
+        
+        std::pair<float, float> quote(buy_price, sell_price);
+        if (quote_resting[t] && last_quote[t] == quote) {
+            return;  // Resting orders already match - leave them in the queue
+        }
+        cancel_quotes(ticker, batch);
+        
+        // Place orders - ids land in active_orders once the batch is back
+        batch.place = true;
+        batch.buy_price = buy_price;
+        batch.sell_price = sell_price;
+        last_quote[t] = quote;
+        quote_resting[t] = true;
+    }
+    
+    // Claim a requote for a dirty ticker if the throttle is open, caller holds its book mutex.
+    // Returns true if the batch has orders for send_orders.
+    bool try_requote(Ticker ticker, double now, OrderBatch& batch) {
+        int t = static_cast<int>(ticker);
+        std::lock_guard<std::mutex> order_guard(order_mutex);
+        if (in_flight[t]) return false;  // its sender requotes once the batch is back
         
-        // Bullish book
-        if (book_imbalance > BOOK_THRESHOLD) {
-            adjusted_mid = mid + (MID_SHIFT * spread);
-            buy_price = adjusted_mid - half_spread;
-            sell_price = adjusted_mid + half_spread;
+        if (now - last_update[t] < UPDATE_INTERVAL) {
+            return false;  // Stays dirty until the throttle opens
         }
-        // Bearish book
-        else if (book_imbalance < (1.0f / BOOK_THRESHOLD)) {
-            adjusted_mid = mid - (MID_SHIFT * spread);
-            buy_price = adjusted_mid - half_spread;
-            sell_price = adjusted_mid + half_spread;
+        last_update[t] = now;
+        dirty[t] = false;
+        
+        update_quotes(ticker, now, batch);
+        in_flight[t] = !batch.empty();
+        return in_flight[t];
+    }
+    
+    // Send claimed batches with no mutex held, then file the returned ids and requote anything dirtied meanwhile
+    void send_orders(Ticker ticker, OrderBatch batch) {
+        int t = static_cast<int>(ticker);
+        for (;;) {
+            std::vector<std::pair<double, bool>> cancel_times;  // elapsed, failed
+            // an order id of 0 means the exchange did not take the order
+            std::int64_t buy_id = 0;
+            std::int64_t sell_id = 0;
+            double buy_time = 0.0;
+            double sell_time = 0.0;
+            try {
+                for (auto oid : batch.cancels) {
+                    double start = get_time();
+                    bool ok = cancel_order(ticker, oid);
+                    cancel_times.emplace_back(get_time() - start, !ok);
+                }
+                if (batch.place) {
+                    double start = get_time();
+                    buy_id = place_limit_order(Side::buy, ticker, BUY_SIZE, batch.buy_price, false);
+                    buy_time = get_time() - start;
+                    start = get_time();
+                    sell_id = place_limit_order(Side::sell, ticker, SELL_SIZE, batch.sell_price, false);
+                    sell_time = get_time() - start;
+                }
+            } catch (...) {
+                // an order call threw - keep whatever did go out, release the claim and requote from scratch next event
+                std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+                std::lock_guard<std::mutex> order_guard(order_mutex);
+                if (buy_id != 0) active_orders[t].push_back(buy_id);
+                quote_resting[t] = false;
+                dirty[t] = true;
+                in_flight[t] = false;
+                throw;
+            }
+            
+            std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+            {
+                std::lock_guard<std::mutex> order_guard(order_mutex);
+                for (const auto& [elapsed, failed] : cancel_times) {
+                    cancel_latency.record(elapsed, failed);
+                }
+                if (batch.place) {
+                    place_latency.record(buy_time, buy_id == 0);
+                    place_latency.record(sell_time, sell_id == 0);
+                    if (buy_id != 0) active_orders[t].push_back(buy_id);
+                    if (sell_id != 0) active_orders[t].push_back(sell_id);
+                    if (buy_id == 0 || sell_id == 0) {
+                        // a rejected leg rests nowhere - requote in full so it gets reposted
+                        quote_resting[t] = false;
+                        dirty[t] = true;
+                    }
+                }
+                in_flight[t] = false;
+            }
+            
+            batch = OrderBatch{};
+            if (!dirty[t] || !try_requote(ticker, get_time(), batch)) return;
         }
-        else {
-            return;  // Book neutral - sit out
+    }
+    
+    // No timer thread here: a requote the throttle held back is retried on the next callback of any
+    // ticker, so a dirty LTC quote goes out as soon as other markets tick past the interval
+    void requote_held_back(double now) {
+        int t = static_cast<int>(TRADE_TICKER);
+        OrderBatch batch;
+        {
+            std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+            if (!dirty[t] || !try_requote(TRADE_TICKER, now, batch)) return;
         }
         
-        // Place orders
-        try {
-            std::int64_t buy_id = place_limit_order(Side::buy, ticker, BUY_SIZE, buy_price, false);
-            std::int64_t sell_id = place_limit_order(Side::sell, ticker, SELL_SIZE, sell_price, false);
-            active_orders[t].push_back(buy_id);
-            active_orders[t].push_back(sell_id);
-        } catch (...) {}
+        send_orders(TRADE_TICKER, std::move(batch));
     }
     
 public:
@@ -169,49 +377,87 @@ public:
     }
     
     void on_trade_update(Ticker ticker, Side side, float quantity, float price) {
-        if (!should_trade(ticker)) return;
+        if (!should_trade(ticker)) {
+            requote_held_back(get_time());
+            return;
+        }
         
         int t = static_cast<int>(ticker);
-        recent_trades[t].push_back({get_time(), side, quantity});
-        
-        // Cleanup old trades
-        double cutoff = get_time() - 60.0;
-        while (!recent_trades[t].empty() && recent_trades[t].front().time < cutoff) {
-            recent_trades[t].pop_front();
+        OrderBatch batch;
+        {
+            std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+            double now = get_time();
+            recent_trades[t].push_back({now, side, quantity});
+            flow_in_window[t][static_cast<int>(side)] += quantity;
+            
+            expire_trades(t, now);
+            if (!update_regime(ticker, now)) return;  // Flow stayed on the same side of its bands - quotes still valid
+            dirty[t] = true;
+            
+            if (!try_requote(ticker, now, batch)) return;
         }
+        
+        send_orders(ticker, std::move(batch));
     }
     
     void on_orderbook_update(Ticker ticker, Side side, float quantity, float price) {
-        if (!should_trade(ticker)) return;
+        if (!should_trade(ticker)) {
+            requote_held_back(get_time());
+            return;
+        }
         
         int t = static_cast<int>(ticker);
-        
-        if (side == Side::buy) {
-            if (quantity > 0.0f) {
-                bids[t][price] = quantity;
-            } else {
-                bids[t].erase(price);
-            }
-        } else {
-            if (quantity > 0.0f) {
-                asks[t][price] = quantity;
+        OrderBatch batch;
+        {
+            std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+            double now = get_time();
+            
+            std::int64_t tick = std::llround(price / PRICE_TICK);  // exact key, immune to float drift between messages
+            if (side == Side::buy) {
+                bid_total[t] += bids[t].update(tick, quantity);
             } else {
-                asks[t].erase(price);
+                ask_total[t] += asks[t].update(tick, quantity);
             }
+            
+            if (update_touch(t, side)) dirty[t] = true;
+            if (update_regime(ticker, now)) dirty[t] = true;
+            if (!dirty[t]) return;  // Deeper level changed inside the same regime - quotes still valid
+            
+            if (!try_requote(ticker, now, batch)) return;
         }
         
-        double now = get_time();
-        if (now - last_update[t] < UPDATE_INTERVAL) {
-            return;
-        }
-        last_update[t] = now;
-        
-        update_quotes(ticker);
+        send_orders(ticker, std::move(batch));
     }
     
     void on_account_update(Ticker ticker, Side side, float price, float quantity,
                           float capital_remaining) {
-        if (!should_trade(ticker)) return;
-        // Fill received - continue trading
+        if (!should_trade(ticker)) {
+            requote_held_back(get_time());
+            return;
+        }
+        
+        int t = static_cast<int>(ticker);
+        double now = get_time();
+        {
+            std::lock_guard<std::mutex> order_guard(order_mutex);
+            
+            // A fill takes size out of one side - requote in full next time
+            quote_resting[t] = false;
+            
+            if (now - last_print_time >= 30.0) {
+                println("Cancels: " + cancel_latency.summary());
+                println("Places: " + place_latency.summary());
+                last_print_time = now;
+            }
+        }
+        
+        OrderBatch batch;
+        {
+            std::lock_guard<std::mutex> book_guard(book_mutex[t]);
+            dirty[t] = true;  // Repost the filled leg without waiting for a touch move
+            if (!try_requote(ticker, now, batch)) return;
+        }
+        
+        send_orders(ticker, std::move(batch));
     }
 };
\ No newline at end of file
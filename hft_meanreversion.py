@@ -1,11 +1,12 @@
-from enum import Enum
+from enum import IntEnum
 import time
+from collections import deque
 
-class Side(Enum):
+class Side(IntEnum):
     BUY = 0
     SELL = 1
 
-class Ticker(Enum):
+class Ticker(IntEnum):
     ETH = 0
     BTC = 1
     LTC = 2
@@ -61,8 +62,9 @@ class Strategy:
     """Mean-reversion strategy with small thresholds and cooldown."""
 
     def __init__(self) -> None:
-        self.prices = []
         self.max_prices_stored = 30
+        self.prices = deque(maxlen=self.max_prices_stored)  # Oldest price drops off automatically
+        self.price_sum = 0.0
         self.capital = 100000
         self.position = 0
         self.max_position = 100
@@ -71,18 +73,19 @@ class Strategy:
         self.cooldown = 0.1  # seconds between trades
 
     def on_trade_update(self, ticker: Ticker, side: Side, price: float, quantity: float) -> None:
+        if len(self.prices) == self.max_prices_stored:
+            self.price_sum -= self.prices[0]  # About to be evicted by the append
         self.prices.append(price)
-        if len(self.prices) > self.max_prices_stored:
-            self.prices.pop(0)
+        self.price_sum += price
 
         if len(self.prices) < 5:
             return
 
-        avg_price = sum(self.prices) / len(self.prices)
+        avg_price = self.price_sum / len(self.prices)
         latest_price = price
         trade_qty = 1
 
-        now = time.time()
+        now = time.monotonic()
         if now - self.last_trade_time < self.cooldown:
             return
 